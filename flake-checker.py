@@ -6,13 +6,36 @@ vllm-flake-checker: Scan Buildkite builds for log patterns (flakes).
 import os
 import sys
 import re
+import gzip
+import zlib
 import json
+import random
+import hashlib
+import shutil
 import time
 import argparse
-from typing import List, Dict, Optional, Tuple
+import threading
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional, Pattern, Tuple
 import requests
 from urllib.parse import urlencode
 
+try:
+    import re2  # Optional: linear-time matching and single-pass multi-pattern prefilter
+except ImportError:
+    re2 = None
+
+try:
+    import orjson  # Optional: faster JSON encoding and decoding
+except ImportError:
+    orjson = None
+
+try:
+    import ahocorasick  # Optional: single-pass matching of many literal patterns
+except ImportError:
+    ahocorasick = None
+
 
 # Default patterns to search for
 DEFAULT_PATTERNS = [
@@ -21,6 +44,319 @@ DEFAULT_PATTERNS = [
     r"get_num_new_matched_tokens 96"
 ]
 
+# Bytes of log context kept on either side of a match
+SNIPPET_CONTEXT = 200
+
+# Lines kept in a snippet before it is truncated
+SNIPPET_MAX_LINES = 10
+
+# Runs of blank lines, collapsed in snippets
+_BLANK_RUN = re.compile(r'\n\s*\n+')
+
+# Bytes read per chunk when streaming job logs
+LOG_CHUNK_SIZE = 64 * 1024
+
+# Extra bytes carried between chunks so matches can span chunk boundaries
+STREAM_OVERLAP = 4096
+
+# Job states after which a log can no longer change, so it is safe to cache
+TERMINAL_JOB_STATES = ("passed", "failed", "broken", "canceled", "timed_out", "expired")
+
+# Job states whose logs can't contain a flake: passed, or never ran
+SKIPPED_JOB_STATES = ("passed", "skipped", "broken", "blocked")
+
+# Literal pattern count above which an Aho-Corasick pass beats per-pattern searches
+AHOCORASICK_MIN_PATTERNS = 16
+
+# Up to this many literals, separate bytes.find calls beat an RE2 union prefilter
+FIND_MAX_LITERALS = 3
+
+# Regex metacharacters; a --regex pattern without any of them is a plain literal
+_REGEX_META = re.compile(r'[.^$*+?{}\[\]\\|()]')
+
+
+def _re2_compile(source: bytes, never_capture: bool = False):
+    """Compile a multiline bytes pattern with RE2. Returns None if RE2 is unavailable or rejects it."""
+    if re2 is None:
+        return None
+
+    options = re2.Options()
+    options.log_errors = False
+    options.never_capture = never_capture
+
+    try:
+        return re2.compile(b"(?m)" + source, options)
+    except re2.error:
+        return None
+
+
+def _json_loads(data: bytes):
+    """Decode JSON bytes, using orjson when it is installed."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _json_dumps(obj, indent: bool = False) -> bytes:
+    """Encode JSON to UTF-8 bytes, using orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else None)
+    return json.dumps(obj, indent=2 if indent else None).encode()
+
+
+class ScanInterrupted(Exception):
+    """Raised in worker threads to abandon their work once the scan is stopping."""
+
+
+class RateLimiter:
+    """Thread-safe request budget driven by Buildkite's RateLimit-* response headers.
+
+    Requests go out immediately while the server reports budget remaining. Once
+    it is used up, callers wait until the rate limit window resets, or until
+    the optional stop event is set.
+    """
+
+    def __init__(self, stop: Optional[threading.Event] = None):
+        self.remaining = None  # Unknown until the first response
+        self.reset_at = 0.0
+        self.lock = threading.Lock()
+        self.stop = stop or threading.Event()
+
+    def acquire(self):
+        """Block until the current window has budget left, then reserve one request."""
+        while True:
+            if self.stop.is_set():
+                raise ScanInterrupted()
+
+            with self.lock:
+                now = time.monotonic()
+
+                if self.remaining is not None and now >= self.reset_at:
+                    self.remaining = None  # New window, wait for the server's count
+
+                if self.remaining is None or self.remaining > 0:
+                    if self.remaining is not None:
+                        self.remaining -= 1
+                    return
+
+                wait_time = self.reset_at - now
+
+            self.stop.wait(wait_time)
+
+    def update(self, headers):
+        """Record the budget reported by a response's RateLimit-* headers."""
+        try:
+            remaining = int(headers["RateLimit-Remaining"])
+            reset = float(headers["RateLimit-Reset"])
+        except (KeyError, ValueError):
+            return
+
+        with self.lock:
+            self.remaining = remaining
+            self.reset_at = time.monotonic() + reset
+
+
+class PatternMatcher:
+    """Finds the first match of each search pattern within a window of raw log bytes.
+
+    Built only from the pattern list and mode, so scan worker processes can
+    rebuild an identical matcher and share pattern indices with the parent.
+    """
+
+    def __init__(self, patterns: Iterable[str], use_regex: bool):
+        self.use_regex = use_regex
+        self.compiled = self._compile_patterns(patterns)
+        self.patterns = tuple(pattern for pattern, _ in self.compiled)
+        self.max_pattern_len = max((len(p.encode()) for p in self.patterns), default=0)
+        self.literals = self._literal_patterns()
+        self.union_sources = self._union_sources()
+        self._union_cache = {}
+        self.automaton = self._build_automaton()
+        self.contained = self._contained_literals()
+
+        # Shorter patterns first, so a literal is searched before any literal containing it
+        self.search_order = sorted(range(len(self.compiled)), key=lambda index: len(self.patterns[index]))
+
+    def _source(self, pattern: str) -> bytes:
+        """Regex source for a pattern, matched against UTF-8 log bytes.
+
+        RE2 treats the bytes as UTF-8, so '.' matches one character. Python's
+        `re` works on raw bytes, where '.', character classes and quantifiers
+        apply to single bytes of a multibyte character: `caf[éè]` also matches `cafá`.
+        """
+        encoded = pattern.encode()
+        # Literal search - escape special regex chars
+        return encoded if self.use_regex else re.escape(encoded)
+
+    def _compile_patterns(self, patterns: Iterable[str]) -> List[Tuple[str, Pattern]]:
+        """Compile patterns once up front. Invalid regexes are reported and dropped."""
+        compiled = []
+        for pattern in patterns:
+            try:
+                source = self._source(pattern)
+                rx = re.compile(source, re.MULTILINE)
+            except re.error as e:
+                print(f"Warning: Invalid regex pattern '{pattern}': {e}", file=sys.stderr)
+                continue
+
+            # Prefer RE2 for real regexes so long or adversarial lines can't backtrack;
+            # patterns it can't handle (backreferences, lookaround) stay on `re`
+            if self.use_regex:
+                re2_rx = _re2_compile(source)
+                if re2_rx is not None:
+                    rx = re2_rx
+                elif not pattern.isascii() and _REGEX_META.search(pattern):
+                    print(f"Warning: Regex pattern '{pattern}' has non-ASCII characters and is matched "
+                          f"byte by byte without RE2; classes and quantifiers apply to single bytes of them",
+                          file=sys.stderr)
+
+            compiled.append((pattern, rx))
+        return compiled
+
+    def _literal_patterns(self) -> Dict[int, bytes]:
+        """Map pattern index to its UTF-8 bytes for every pattern that is a plain literal."""
+        return {index: pattern.encode() for index, pattern in enumerate(self.patterns)
+                if not self.use_regex or not _REGEX_META.search(pattern)}
+
+    def _union_sources(self) -> Dict[int, bytes]:
+        """Map pattern index to its source for every pattern RE2 can include in a union."""
+        sources = {}
+        for index, (pattern, _) in enumerate(self.compiled):
+            source = self._source(pattern)
+            if _re2_compile(source) is not None:
+                sources[index] = source
+        return sources
+
+    def _union_for(self, indices: Tuple[int, ...]):
+        """Return a cached RE2 alternation of the given patterns, or None if not applicable."""
+        if not indices:
+            return None
+
+        if indices not in self._union_cache:
+            source = b"|".join(b"(?:" + self.union_sources[i] + b")" for i in indices)
+            self._union_cache[indices] = _re2_compile(source, never_capture=True)
+
+        return self._union_cache[indices]
+
+    def _search_starts(self, pending: List[int], window: bytes, pos: int) -> Dict[int, int]:
+        """Map each pending pattern worth searching to where its search can begin.
+
+        A single RE2 pass over the union of pending patterns finds the leftmost
+        position any of them matches: none of them can match earlier, and if
+        there is no hit they can't match in this window at all.
+        """
+        starts = {index: pos for index in pending}
+
+        # A few literals are found faster by searching for each directly
+        if len(pending) <= FIND_MAX_LITERALS and all(index in self.literals for index in pending):
+            return starts
+
+        indices = tuple(index for index in pending if index in self.union_sources)
+        union = self._union_for(indices)
+
+        if union is None:
+            return starts
+
+        hit = union.search(window, pos)
+        for index in indices:
+            if hit:
+                starts[index] = hit.start()
+            else:
+                del starts[index]
+
+        return starts
+
+    def _build_automaton(self):
+        """Build an Aho-Corasick automaton over literal patterns, if worthwhile."""
+        if ahocorasick is None or self.use_regex or len(self.compiled) < AHOCORASICK_MIN_PATTERNS:
+            return None
+
+        # pyahocorasick matches str, so bytes are mapped 1:1 to Latin-1 characters
+        words = {}
+        for index, (pattern, _) in enumerate(self.compiled):
+            words.setdefault(pattern.encode().decode("latin-1"), []).append(index)
+
+        automaton = ahocorasick.Automaton()
+        for word, indices in words.items():
+            automaton.add_word(word, (len(word), indices))
+        automaton.make_automaton()
+        return automaton
+
+    def _contained_literals(self) -> Dict[int, List[int]]:
+        """Map each literal pattern to the shorter literal patterns it contains.
+
+        If a contained literal has no match in a window, the longer one can't
+        match there either, so its search can be skipped.
+        """
+        contained = {}
+        for index, literal in self.literals.items():
+            inner = [other for other, candidate in self.literals.items()
+                     if other != index and candidate in literal]
+            if inner:
+                contained[index] = inner
+        return contained
+
+    def search_window(self, pending: List[int], window: bytes, pos: int) -> Dict[int, Tuple[int, int]]:
+        """Find the first match span of each pending pattern in window[pos:]."""
+        starts = self._search_starts(pending, window, pos)
+        spans = {}
+
+        if not starts:
+            return spans
+
+        if self.automaton is not None:
+            # One pass reports every literal hit in order of position
+            wanted = set(starts)
+            text = window.decode("latin-1")
+            for last, (length, indices) in self.automaton.iter(text, min(starts.values())):
+                for index in indices:
+                    if index in wanted:
+                        spans[index] = (last + 1 - length, last + 1)
+                        wanted.discard(index)
+                if not wanted:
+                    break
+            return spans
+
+        missed = {}
+        for index in self.search_order:
+            if index not in starts:
+                continue
+            start = starts[index]
+
+            # Skip if a literal this one contains was already searched from here and not found
+            if any(missed.get(inner, len(window)) <= start for inner in self.contained.get(index, ())):
+                continue
+
+            literal = self.literals.get(index)
+            if literal is not None:
+                # bytes.find is a plain substring search, no regex engine involved
+                at = window.find(literal, start)
+                if at >= 0:
+                    spans[index] = (at, at + len(literal))
+                else:
+                    missed[index] = start
+                continue
+
+            match = self.compiled[index][1].search(window, start)
+            if match:
+                spans[index] = match.span()
+            else:
+                missed[index] = start
+        return spans
+
+
+# Per-process matchers for scan workers, keyed by (patterns, use_regex)
+_worker_matchers = {}
+
+
+def _search_in_worker(patterns: Tuple[str, ...], use_regex: bool, pending: List[int],
+                      window: bytes, pos: int) -> Dict[int, Tuple[int, int]]:
+    """Scan worker entry point: search a window with this process's cached matcher."""
+    key = (patterns, use_regex)
+    if key not in _worker_matchers:
+        _worker_matchers[key] = PatternMatcher(patterns, use_regex)
+    return _worker_matchers[key].search_window(pending, window, pos)
+
 
 class FlakeChecker:
     def __init__(self, args):
@@ -29,40 +365,87 @@ class FlakeChecker:
         self.pipeline = args.pipeline
         self.branch_regex = args.branch_regex
         self.step_substr = args.step_substr
+        self.step_substr_lower = self.step_substr.lower()
         self.max_builds = args.max_builds
         self.use_regex = args.regex
         self.json_output = args.json
+        self.cache_dir = None if args.no_cache else os.path.expanduser(args.cache_dir)
+        self.cache_max_age = max(0, args.cache_max_age)
+        self.build_states = [state.strip() for state in args.build_states.split(",") if state.strip()]
+        self.skip_job_states = set(SKIPPED_JOB_STATES)
+        if args.include_passed:
+            self.skip_job_states.discard("passed")
+        self.concurrency = max(1, args.concurrency)
+        self.scan_workers = max(0, args.scan_workers)
+        self.scan_pool = None
         self.patterns = self._load_patterns(args.patterns_file)
+        self.matcher = PatternMatcher(self.patterns, self.use_regex)
+
+        # Job results from earlier runs, keyed by build number then job id
+        self.rescan = args.rescan
+        self.checkpoint = {}
+
+        try:
+            self.branch_rx = re.compile(self.branch_regex) if self.branch_regex else None
+        except re.error as e:
+            print(f"Error: Invalid branch regex '{self.branch_regex}': {e}", file=sys.stderr)
+            sys.exit(1)
 
         self.api_base = "https://api.buildkite.com/v2"
         self.headers = {"Authorization": f"Bearer {self.token}"}
 
+        # One session so all workers reuse keep-alive connections
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=self.concurrency + 1)
+        self.session.mount("https://", adapter)
+        # Set when the scan stops, so worker threads drop their downloads
+        self.interrupted = threading.Event()
+        self.rate_limiter = RateLimiter(self.interrupted)
+
         # Statistics
         self.builds_scanned = 0
         self.jobs_scanned = 0
         self.matches = []
+        self.matches_found = 0
+
+        # Optional NDJSON file that matches are streamed to instead of kept in memory
+        self.output_path = args.output
+        self.output_file = None
+
+        # Cache failures are reported once, then the scan carries on without it
+        self.cache_warned = False
+        self.cache_warning_lock = threading.Lock()
 
     def _load_patterns(self, patterns_file: Optional[str]) -> List[str]:
         """Load patterns from file or use defaults."""
         if patterns_file and os.path.exists(patterns_file):
             with open(patterns_file, 'r') as f:
                 patterns = [line.strip() for line in f if line.strip() and not line.startswith('#')]
+            # Drop exact duplicates, keeping the first occurrence's position
+            patterns = list(dict.fromkeys(patterns))
             return patterns if patterns else DEFAULT_PATTERNS
         return DEFAULT_PATTERNS
 
-    def _make_request(self, url: str, timeout: int = 30, max_retries: int = 3) -> requests.Response:
+    def _make_request(self, url: str, timeout: int = 30, max_retries: int = 3,
+                      stream: bool = False, headers: Optional[Dict] = None) -> requests.Response:
         """Make HTTP request with retry logic for 429/5xx errors."""
         for attempt in range(max_retries):
             try:
-                response = requests.get(url, headers=self.headers, timeout=timeout)
+                # Share the API budget across all workers
+                self.rate_limiter.acquire()
+                response = self.session.get(url, headers=headers, timeout=timeout, stream=stream)
+                self.rate_limiter.update(response.headers)
 
                 # Retry on rate limit or server errors
                 if response.status_code == 429 or response.status_code >= 500:
                     if attempt < max_retries - 1:
-                        # Longer wait for rate limits
+                        # Longer wait for rate limits, with jitter so workers don't retry in lockstep
                         wait_time = (2 ** attempt) * (5 if response.status_code == 429 else 1)
-                        print(f"Rate limit hit, waiting {wait_time}s...", file=sys.stderr)
-                        time.sleep(wait_time)
+                        wait_time += random.uniform(0, 0.5 * 2 ** attempt)
+                        print(f"Rate limit hit, waiting {wait_time:.1f}s...", file=sys.stderr)
+                        response.close()
+                        self.interrupted.wait(wait_time)
                         continue
 
                 response.raise_for_status()
@@ -74,7 +457,7 @@ class FlakeChecker:
                 raise
             except requests.exceptions.RequestException:
                 if attempt < max_retries - 1 and attempt > 0:
-                    time.sleep(1)
+                    self.interrupted.wait(1)
                     continue
                 raise
 
@@ -83,58 +466,172 @@ class FlakeChecker:
     def get_builds(self, page: int = 1, per_page: int = 50) -> Tuple[List[Dict], Optional[str]]:
         """Fetch builds from Buildkite API (includes jobs in response)."""
         params = {"page": page, "per_page": per_page, "include_retried_jobs": "true"}
-        url = f"{self.api_base}/organizations/{self.org}/pipelines/{self.pipeline}/builds?{urlencode(params)}"
+        if self.build_states:
+            params["state[]"] = self.build_states
+        url = f"{self.api_base}/organizations/{self.org}/pipelines/{self.pipeline}/builds?{urlencode(params, doseq=True)}"
+
+        # Revalidate the previous response for this page so unchanged pages come back as 304
+        cached = self._load_cached_response(url)
+        headers = {}
+        if cached and cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached and cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+
+        response = self._make_request(url, headers=headers)
+
+        if response.status_code == 304 and cached:
+            return cached["builds"], cached["next_url"]
 
-        response = self._make_request(url)
+        builds = _json_loads(response.content)
         next_url = response.links.get("next", {}).get("url")
 
-        return response.json(), next_url
+        if response.headers.get("ETag") or response.headers.get("Last-Modified"):
+            self._store_cached_response(url, {
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "next_url": next_url,
+                "builds": builds
+            })
+
+        return builds, next_url
+
+    def _response_cache_path(self, url: str) -> Optional[str]:
+        """Path of the cached API response for a URL, or None if caching is disabled."""
+        if not self.cache_dir:
+            return None
+        key = hashlib.sha256(url.encode()).hexdigest()
+        return os.path.join(self.cache_dir, "responses", f"{key}.json")
+
+    def _load_cached_response(self, url: str) -> Optional[Dict]:
+        """Load a previously stored API response, or None if there isn't a usable one."""
+        path = self._response_cache_path(url)
+        if not path or not os.path.exists(path):
+            return None
 
-    def get_job_log(self, build_number: int, job_id: str) -> Optional[str]:
-        """Fetch log for a specific job. Returns None if log not available."""
+        try:
+            with open(path, 'rb') as f:
+                entry = _json_loads(f.read())
+        except (OSError, ValueError):
+            return None
+
+        # Anything else (hand-edited, or written by another version) is a miss
+        if not isinstance(entry, dict) or not isinstance(entry.get("builds"), list) or "next_url" not in entry:
+            return None
+        if not all(isinstance(entry.get(key), (str, type(None))) for key in ("etag", "last_modified", "next_url")):
+            return None
+        return entry
+
+    def _store_cached_response(self, url: str, entry: Dict):
+        """Atomically store an API response along with its validators, if the cache is writable."""
+        path = self._response_cache_path(url)
+        if not path:
+            return
+
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                f.write(_json_dumps(entry))
+            os.replace(tmp_path, path)
+        except OSError as e:
+            # The response is still used; it just won't be revalidated next run
+            self._warn_cache(e)
+            if os.path.exists(tmp_path):
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+
+    def get_job_log(self, build_number: int, job_id: str) -> Optional[requests.Response]:
+        """Open a streaming response for a job log. Returns None if log not available."""
         url = f"{self.api_base}/organizations/{self.org}/pipelines/{self.pipeline}/builds/{build_number}/jobs/{job_id}/log?format=txt"
 
         try:
-            response = self._make_request(url, timeout=60)
-            # Add small delay to avoid rate limiting
-            time.sleep(0.3)
-            return response.text
+            return self._make_request(url, timeout=60, stream=True)
         except requests.HTTPError as e:
             if e.response.status_code == 404:
                 return None  # Log not available
             raise
 
-    def find_pattern_matches(self, text: str) -> List[Tuple[str, str]]:
-        """Find all matching patterns in text. Returns list of (pattern, snippet) tuples."""
-        matches = []
+    def scan_chunks(self, chunks: Iterable[bytes]) -> List[Tuple[str, str]]:
+        """Find matching patterns in a log delivered in chunks.
 
-        for pattern in self.patterns:
-            try:
-                if self.use_regex:
-                    match = re.search(pattern, text, re.MULTILINE)
+        Logs are scanned as raw bytes and only the snippet around a match is
+        decoded. Only a window of the most recent bytes is kept in memory, so
+        peak usage is bounded by the chunk size rather than the log size. Each
+        pattern reports its first match, and scanning stops early once every
+        pattern has matched.
+        """
+        found = {}
+        pending = list(range(len(self.matcher.patterns)))
+        keep = self.matcher.max_pattern_len + 2 * SNIPPET_CONTEXT + STREAM_OVERLAP
+        window = b""
+        pos = 0
+
+        chunks = iter(chunks)
+        chunk = next(chunks, None)
+
+        while chunk is not None and pending:
+            if self.interrupted.is_set():
+                raise ScanInterrupted()
+
+            window += chunk
+
+            if self.scan_pool:
+                # Search in a worker process while this thread downloads the next chunk
+                search = self.scan_pool.submit(_search_in_worker, self.matcher.patterns,
+                                               self.use_regex, pending, window, pos)
+                next_chunk = next(chunks, None)
+                spans = search.result()
+            else:
+                next_chunk = next(chunks, None)
+                spans = self.matcher.search_window(pending, window, pos)
+
+            final = next_chunk is None
+
+            unmatched = []
+            for index in pending:
+                span = spans.get(index)
+
+                # Wait for more text if the trailing context isn't available yet. At least
+                # one byte past it is needed to tell whether the context ends mid-character.
+                if span and (final or span[1] + SNIPPET_CONTEXT < len(window)):
+                    found[index] = self._make_snippet(window, *span)
                 else:
-                    # Literal search - escape special regex chars
-                    escaped = re.escape(pattern)
-                    match = re.search(escaped, text, re.MULTILINE)
-
-                if match:
-                    # Extract snippet with context
-                    start = max(0, match.start() - 200)
-                    end = min(len(text), match.end() + 200)
-                    snippet = text[start:end].strip()
-
-                    # Clean up snippet - remove excessive whitespace
-                    snippet = re.sub(r'\n\s*\n+', '\n', snippet)
-                    lines = snippet.splitlines()
-                    if len(lines) > 10:
-                        snippet = '\n'.join(lines[:10]) + '\n...'
-
-                    matches.append((pattern, snippet))
-            except re.error as e:
-                print(f"Warning: Invalid regex pattern '{pattern}': {e}", file=sys.stderr)
-                continue
+                    unmatched.append(index)
+            pending = unmatched
+
+            if len(window) > keep:
+                # Keep one extra leading byte and search after it, so that
+                # '^' and lookbehinds don't see a false line start at the cut
+                window = window[-(keep + 1):]
+                pos = 1
+
+            chunk = next_chunk
+
+        return [(self.matcher.patterns[index], found[index]) for index in sorted(found)]
 
-        return matches
+    def _make_snippet(self, log: bytes, match_start: int, match_end: int) -> str:
+        """Extract and decode a cleaned-up snippet around a match."""
+        start = max(0, match_start - SNIPPET_CONTEXT)
+        end = min(len(log), match_end + SNIPPET_CONTEXT)
+
+        # Don't cut a UTF-8 character in half at either edge
+        while start < match_start and 0x80 <= log[start] < 0xC0:
+            start += 1
+        while end > match_end and end < len(log) and 0x80 <= log[end] < 0xC0:
+            end -= 1
+
+        # Clean up snippet - remove excessive whitespace
+        snippet = _BLANK_RUN.sub('\n', log[start:end].decode("utf-8", "replace")).strip()
+
+        # Only split off as many lines as we keep
+        lines = snippet.split('\n', SNIPPET_MAX_LINES)
+        if len(lines) > SNIPPET_MAX_LINES:
+            snippet = '\n'.join(lines[:SNIPPET_MAX_LINES]) + '\n...'
+
+        return snippet
 
     def scan_builds(self):
         """Main scanning logic."""
@@ -144,8 +641,19 @@ class FlakeChecker:
 
         page = 1
         fetched = 0
+        self.checkpoint = {} if self.rescan else self._load_checkpoint()
+        pool = ThreadPoolExecutor(max_workers=self.concurrency)
+        pending = []
+
+        if self.scan_workers:
+            # Spawn rather than fork, since download threads may already be running
+            self.scan_pool = ProcessPoolExecutor(max_workers=self.scan_workers,
+                                                 mp_context=multiprocessing.get_context("spawn"))
 
         try:
+            if self.output_path:
+                self.output_file = open(self.output_path, 'wb')
+
             print(f"Scanning up to {self.max_builds} builds...", file=sys.stderr)
 
             while fetched < self.max_builds:
@@ -162,14 +670,12 @@ class FlakeChecker:
                     branch = build.get("branch", "")
 
                     # Filter by branch regex
-                    if self.branch_regex and not re.search(self.branch_regex, branch):
+                    if self.branch_rx and not self.branch_rx.search(branch):
                         continue
 
                     self.builds_scanned += 1
                     build_number = build["number"]
-                    web_url = build.get("web_url", "")
                     state = build.get("state", "unknown")
-                    created_at = build.get("created_at", "")
 
                     print(f"Build #{build_number} [{branch}] - {state}", file=sys.stderr)
 
@@ -183,86 +689,361 @@ class FlakeChecker:
                     for job in jobs:
                         label = job.get("label") or job.get("name") or ""
 
-                        if self.step_substr.lower() not in label.lower():
+                        if self.step_substr_lower not in label.lower():
                             continue
 
-                        self.jobs_scanned += 1
-                        job_id = job["id"]
+                        # Flakes only show up in jobs that didn't pass
                         job_state = job.get("state", "unknown")
-
-                        print(f"  Checking: {label} ({job_state})", file=sys.stderr)
-
-                        # Get job log
-                        try:
-                            log = self.get_job_log(build_number, job_id)
-                        except Exception as e:
-                            print(f"  Warning: Failed to fetch log: {e}", file=sys.stderr)
-                            continue
-
-                        if not log:
+                        if job_state in self.skip_job_states:
                             continue
 
-                        # Search for patterns
-                        pattern_matches = self.find_pattern_matches(log)
+                        self.jobs_scanned += 1
 
-                        # Clear log from memory immediately
-                        del log
+                        stored = self.checkpoint.get(str(build_number), {}).get(job["id"])
+                        if stored is not None:
+                            print(f"  Checking: {label} ({job_state}, from checkpoint)", file=sys.stderr)
+                            future = Future()
+                            future.set_result(stored)
+                        else:
+                            print(f"  Checking: {label} ({job_state})", file=sys.stderr)
 
-                        # Record matches
-                        if pattern_matches:
-                            print(f"  ✓ MATCH FOUND in {label}!", file=sys.stderr)
+                            # Fetch and scan the log in the background
+                            future = pool.submit(self.scan_job, build_number, job)
+                        pending.append((build, job, label, future))
 
-                        for pattern, snippet in pattern_matches:
-                            self.matches.append({
-                                "build_number": build_number,
-                                "branch": branch,
-                                "state": state,
-                                "created_at": created_at,
-                                "step_label": label,
-                                "web_url": web_url,
-                                "pattern": pattern,
-                                "snippet": snippet
-                            })
+                # Collect this page's results in submission order
+                self._collect_results(pending)
+                pending = []
+                self._save_checkpoint()
 
                 if not next_url:
                     break
 
                 page += 1
 
+            # Expire old cache entries, but only once a scan has completed
+            self._prune_cache()
+
         except KeyboardInterrupt:
             print("\nScan interrupted by user.", file=sys.stderr)
             sys.exit(130)
         except Exception as e:
             print(f"Error during scan: {e}", file=sys.stderr)
             sys.exit(1)
+        finally:
+            # Queued jobs are cancelled; running ones stop at their next chunk or request
+            self.interrupted.set()
+            pool.shutdown(wait=False, cancel_futures=True)
+
+            # Keep scans that finished but weren't collected before the scan stopped
+            for build, job, _, future in pending:
+                if future.done() and not future.cancelled() and future.exception() is None:
+                    self._checkpoint_job(build["number"], job, future.result())
+
+            # Also runs on interrupt, so a re-run skips the jobs already scanned
+            self._save_checkpoint()
+
+            if self.scan_pool:
+                self.scan_pool.shutdown(wait=False)
+                self.scan_pool = None
+
+            if self.output_file:
+                self.output_file.close()
+
+    def scan_job(self, build_number: int, job: Dict) -> Optional[List[Tuple[str, str]]]:
+        """Fetch a job log (from cache if possible) and search it. Returns None if log not available."""
+        job_id = job["id"]
+        cache_path = self._log_cache_path(build_number, job_id)
+
+        if cache_path and os.path.exists(cache_path):
+            try:
+                with gzip.open(cache_path, "rb") as f:
+                    return self.scan_chunks(iter(lambda: f.read(LOG_CHUNK_SIZE), b""))
+            except (OSError, EOFError, gzip.BadGzipFile, zlib.error) as e:
+                # Drop the unreadable entry and fetch the log again
+                print(f"  Warning: Discarding unreadable cached log {cache_path}: {e}", file=sys.stderr)
+                try:
+                    os.remove(cache_path)
+                except OSError:
+                    pass
+
+        response = self.get_job_log(build_number, job_id)
+
+        if response is None:
+            return None
+
+        with response:
+            # Scan raw bytes: no whole-log decode, only matched snippets are decoded
+            chunks = response.iter_content(chunk_size=LOG_CHUNK_SIZE)
+
+            # Logs of finished jobs never change, so keep a copy for later runs
+            caching = cache_path and job.get("state") in TERMINAL_JOB_STATES
+            if caching:
+                chunks = self._cache_chunks(chunks, cache_path)
+
+            try:
+                pattern_matches = self.scan_chunks(chunks)
+
+                # The scan stops once every pattern has matched, but the log is still
+                # worth caching: flaky logs are the ones most likely to be looked at again
+                if caching and not self.cache_warned:
+                    for _ in chunks:
+                        if self.interrupted.is_set():
+                            raise ScanInterrupted()
+
+                return pattern_matches
+            finally:
+                chunks.close()
+
+    def _log_cache_path(self, build_number: int, job_id: str) -> Optional[str]:
+        """Path of the cached log for a job, or None if caching is disabled."""
+        if not self.cache_dir:
+            return None
+        return os.path.join(self.cache_dir, "logs", self.org, self.pipeline, str(build_number), f"{job_id}.log.gz")
+
+    def _prune_cache(self):
+        """Delete cached logs older than --cache-max-age days, with their checkpointed results."""
+        if not self.cache_dir or not self.cache_max_age:
+            return
+
+        cutoff = time.time() - self.cache_max_age * 86400
+        root = os.path.join(self.cache_dir, "logs", self.org, self.pipeline)
+        try:
+            build_dirs = os.listdir(root)
+        except OSError:
+            return
+
+        for build in build_dirs:
+            build_dir = os.path.join(root, build)
+            try:
+                names = os.listdir(build_dir)
+            except OSError:
+                continue
+
+            for name in names:
+                path = os.path.join(build_dir, name)
+                try:
+                    if os.path.getmtime(path) >= cutoff:
+                        continue
+                    os.remove(path)
+                except OSError:
+                    continue
+
+                # A result is only reused while its log is cached, so it expires with it
+                if name.endswith(".log.gz"):
+                    self.checkpoint.get(build, {}).pop(name[:-len(".log.gz")], None)
+
+            # Only succeeds once the build directory is empty
+            try:
+                os.rmdir(build_dir)
+            except OSError:
+                pass
+
+        self.checkpoint = {number: jobs for number, jobs in self.checkpoint.items() if jobs}
+
+    def _cache_chunks(self, chunks: Iterable[bytes], path: str) -> Iterator[bytes]:
+        """Pass chunks through while writing them to the cache.
+
+        The cache file only appears once the whole log has been read, so a scan
+        that stops early or fails never leaves a truncated log behind. The cache
+        is best-effort: if it can't be written, chunks still pass through.
+        """
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        complete = False
+        f = None
+
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            f = gzip.open(tmp_path, "wb", compresslevel=1)
+        except OSError as e:
+            self._warn_cache(e)
+
+        try:
+            for chunk in chunks:
+                if f is not None:
+                    try:
+                        f.write(chunk)
+                    except OSError as e:
+                        self._warn_cache(e)
+                        self._close_quietly(f)
+                        f = None
+                yield chunk
+
+            if f is not None:
+                try:
+                    f.close()
+                    os.replace(tmp_path, path)
+                    complete = True
+                except OSError as e:
+                    self._warn_cache(e)
+        finally:
+            if f is not None and not complete:
+                self._close_quietly(f)
+            if not complete and os.path.exists(tmp_path):
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+
+    @staticmethod
+    def _close_quietly(f):
+        """Close a cache file that is being abandoned, ignoring errors."""
+        try:
+            f.close()
+        except OSError:
+            pass
+
+    def _warn_cache(self, error: OSError):
+        """Report the first cache write failure; later ones are silent."""
+        with self.cache_warning_lock:
+            if self.cache_warned:
+                return
+            self.cache_warned = True
+        print(f"Warning: Cache write failed, continuing without it: {error}", file=sys.stderr)
+
+    def _checkpoint_path(self) -> Optional[str]:
+        """Path of the scan checkpoint for this pipeline, or None if caching is disabled."""
+        if not self.cache_dir:
+            return None
+        return os.path.join(self.cache_dir, "state", self.org, f"{self.pipeline}.json")
+
+    def _checkpoint_key(self) -> str:
+        """Fingerprint of the settings that stored job results depend on."""
+        # Canonical stdlib encoding, so the key doesn't change with the installed JSON library
+        settings = json.dumps([list(self.matcher.patterns), self.use_regex], separators=(",", ":"))
+        return hashlib.sha256(settings.encode()).hexdigest()
+
+    def _load_checkpoint(self) -> Dict[str, Dict[str, List]]:
+        """Load job results stored by earlier runs, or nothing if they used other patterns."""
+        path = self._checkpoint_path()
+        if not path or not os.path.exists(path):
+            return {}
+
+        try:
+            with open(path, 'rb') as f:
+                state = _json_loads(f.read())
+        except (OSError, ValueError):
+            return {}
+
+        if not isinstance(state, dict) or state.get("key") != self._checkpoint_key():
+            return {}
+        return state.get("builds", {})
+
+    def _save_checkpoint(self):
+        """Atomically write the job results gathered so far, if the cache is writable."""
+        path = self._checkpoint_path()
+        if not path:
+            return
+
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                f.write(_json_dumps({"key": self._checkpoint_key(), "builds": self.checkpoint}))
+            os.replace(tmp_path, path)
+        except OSError as e:
+            # The scan itself is unaffected; a re-run just can't resume from here
+            self._warn_cache(e)
+            if os.path.exists(tmp_path):
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+
+    def _checkpoint_job(self, build_number: int, job: Dict, pattern_matches: Optional[List[Tuple[str, str]]]):
+        """Remember a job's results for later runs, if the job has finished and its log was found."""
+        # Results for finished jobs won't change, so later runs can reuse them
+        if pattern_matches is not None and job.get("state") in TERMINAL_JOB_STATES:
+            self.checkpoint.setdefault(str(build_number), {})[job["id"]] = pattern_matches
+
+    def _collect_results(self, pending: List[Tuple[Dict, Dict, str, Future]]):
+        """Wait for submitted job scans and record their matches."""
+        for build, job, label, future in pending:
+            build_number = build["number"]
+
+            try:
+                pattern_matches = future.result()
+            except Exception as e:
+                print(f"  Warning: Failed to fetch log for #{build_number} {label}: {e}", file=sys.stderr)
+                continue
+
+            self._checkpoint_job(build_number, job, pattern_matches)
+
+            if not pattern_matches:
+                continue
+
+            print(f"  ✓ MATCH FOUND in #{build_number} {label}!", file=sys.stderr)
+
+            for pattern, snippet in pattern_matches:
+                self._record_match({
+                    "build_number": build_number,
+                    "branch": build.get("branch", ""),
+                    "state": build.get("state", "unknown"),
+                    "created_at": build.get("created_at", ""),
+                    "step_label": label,
+                    "web_url": build.get("web_url", ""),
+                    "pattern": pattern,
+                    "snippet": snippet
+                })
+
+    def _record_match(self, match: Dict):
+        """Stream a match to the output file, or keep it in memory if there is none."""
+        self.matches_found += 1
+
+        if self.output_file:
+            self.output_file.write(_json_dumps(match) + b"\n")
+            self.output_file.flush()
+        else:
+            self.matches.append(match)
+
+    def _iter_matches(self) -> Iterator[Dict]:
+        """Yield recorded matches, reading them back lazily if they were streamed to a file."""
+        if not self.output_path:
+            yield from self.matches
+            return
+
+        with open(self.output_path, 'rb') as f:
+            for line in f:
+                yield _json_loads(line)
+
+    def _write_json(self, summary: Dict, matches: Iterable[Dict]):
+        """Write the JSON report one match at a time, laid out like a single indented dump."""
+        def nested(obj, prefix):
+            return _json_dumps(obj, indent=True).decode().replace("\n", "\n" + prefix)
+
+        sys.stdout.write('{\n  "summary": ' + nested(summary, "  ") + ',\n  "matches": [')
+
+        separator = "\n    "
+        for match in matches:
+            sys.stdout.write(separator + nested(match, "    "))
+            separator = ",\n    "
+
+        sys.stdout.write("]\n}\n" if separator == "\n    " else "\n  ]\n}\n")
 
     def output_results(self):
         """Output results in requested format."""
         if self.json_output:
             # JSON output
-            output = {
-                "summary": {
-                    "builds_scanned": self.builds_scanned,
-                    "jobs_scanned": self.jobs_scanned,
-                    "matches_found": len(self.matches)
-                },
-                "matches": self.matches
+            summary = {
+                "builds_scanned": self.builds_scanned,
+                "jobs_scanned": self.jobs_scanned,
+                "matches_found": self.matches_found
             }
-            print(json.dumps(output, indent=2))
+            self._write_json(summary, self._iter_matches())
         else:
             # Human-readable output
-            if not self.matches:
+            if not self.matches_found:
                 print("\nNo matching patterns found in the scanned builds.")
             else:
-                print(f"\nFound {len(self.matches)} matching failure(s):\n")
+                print(f"\nFound {self.matches_found} matching failure(s):\n")
 
-                for match in self.matches:
+                for match in self._iter_matches():
                     print(f"- #{match['build_number']} [{match['branch']}] {match['step_label']} — {match['web_url']}")
                     print(f"  Pattern: {match['pattern']}")
                     print(f"  Snippet: {match['snippet'][:150]}...")
                     print()
 
-            print(f"Scanned {self.builds_scanned} builds, {self.jobs_scanned} jobs, {len(self.matches)} matches found.")
+            print(f"Scanned {self.builds_scanned} builds, {self.jobs_scanned} jobs, {self.matches_found} matches found.")
 
 
 def parse_args():
@@ -303,6 +1084,49 @@ def parse_args():
         default=int(os.getenv("BK_MAX_BUILDS", "200")),
         help="Maximum builds to scan (env: BK_MAX_BUILDS, default: 200)"
     )
+    parser.add_argument(
+        "--build-states",
+        default=os.getenv("BK_BUILD_STATES", ""),
+        help="Comma-separated build states to fetch, filtered by the API (env: BK_BUILD_STATES, default: all)"
+    )
+    parser.add_argument(
+        "--include-passed",
+        action="store_true",
+        help="Also scan logs of jobs that passed"
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=int(os.getenv("BK_CONCURRENCY", "8")),
+        help="Number of job logs to fetch in parallel (env: BK_CONCURRENCY, default: 8)"
+    )
+    parser.add_argument(
+        "--scan-workers",
+        type=int,
+        default=int(os.getenv("BK_SCAN_WORKERS", "0")),
+        help="Processes to run pattern scans in, overlapping with downloads; 0 scans in the download threads (env: BK_SCAN_WORKERS, default: 0)"
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=os.getenv("BK_CACHE_DIR", "~/.cache/vllm-flake-checker"),
+        help="Directory for cached job logs, build list pages and the scan checkpoint (env: BK_CACHE_DIR, default: ~/.cache/vllm-flake-checker)"
+    )
+    parser.add_argument(
+        "--cache-max-age",
+        type=int,
+        default=int(os.getenv("BK_CACHE_MAX_AGE", "30")),
+        help="Days to keep cached job logs and their results; 0 keeps them forever (env: BK_CACHE_MAX_AGE, default: 30)"
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Disable all caching: job logs, build list pages and the scan checkpoint"
+    )
+    parser.add_argument(
+        "--rescan",
+        action="store_true",
+        help="Scan every job again instead of reusing results from earlier runs"
+    )
     parser.add_argument(
         "--patterns-file",
         default=os.getenv("BK_PATTERNS_FILE"),
@@ -318,6 +1142,11 @@ def parse_args():
         action="store_true",
         help="Output results as JSON"
     )
+    parser.add_argument(
+        "--output",
+        default=os.getenv("BK_OUTPUT"),
+        help="Stream matches to this file as NDJSON as they are found (env: BK_OUTPUT)"
+    )
 
     return parser.parse_args()
 
@@ -0,0 +1,494 @@
+"""Exercise FlakeChecker's network-facing features against a fake Buildkite session.
+
+Run with: python -m unittest discover tests
+"""
+
+import gzip
+import importlib.util
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "flake-checker.py")
+
+spec = importlib.util.spec_from_file_location("flake_checker", SCRIPT)
+flake_checker = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(flake_checker)
+
+API = "https://api.test/v2"
+
+
+class FakeResponse:
+    """The parts of requests.Response that FlakeChecker uses."""
+
+    def __init__(self, status_code=200, body=b"", headers=None, links=None, chunk_delay=0.0):
+        self.status_code = status_code
+        self.content = body
+        self.headers = headers or {}
+        self.links = links or {}
+        self.chunk_delay = chunk_delay
+        self.chunks_sent = 0
+        self.closed = False
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.content), chunk_size):
+            if self.closed:
+                return
+            time.sleep(self.chunk_delay)
+            self.chunks_sent += 1
+            yield self.content[start:start + chunk_size]
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} error", response=self)
+
+    def close(self):
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class FakeSession:
+    """Serves one page of builds, with ETag revalidation, and job logs keyed by job id."""
+
+    def __init__(self, builds, logs, chunk_delays=None):
+        self.builds = builds
+        self.logs = logs
+        self.chunk_delays = chunk_delays or {}
+        self.etag = '"v1"'
+        self.log_requests = []
+        self.page_requests = []
+        self.responses = {}
+        self.lock = threading.Lock()
+
+    def get(self, url, headers=None, timeout=None, stream=False):
+        path = urlparse(url).path
+
+        if path.endswith("/log"):
+            job_id = path.split("/")[-2]
+            with self.lock:
+                self.log_requests.append(job_id)
+            if job_id not in self.logs:
+                return FakeResponse(404)
+            response = FakeResponse(body=self.logs[job_id], chunk_delay=self.chunk_delays.get(job_id, 0.0))
+            self.responses[job_id] = response
+            return response
+
+        self.page_requests.append(parse_qs(urlparse(url).query))
+        if headers and headers.get("If-None-Match") == self.etag:
+            return FakeResponse(304, headers={"ETag": self.etag})
+        body = flake_checker._json_dumps(self.builds)
+        return FakeResponse(body=body, headers={"ETag": self.etag})
+
+
+def make_build(number, job_state="failed"):
+    return {
+        "number": number,
+        "branch": f"pull/{number}",
+        "state": "failed",
+        "web_url": f"https://buildkite.test/builds/{number}",
+        "created_at": "2025-01-01",
+        "jobs": [{"id": f"job-{number}", "label": "v1 Test others", "state": job_state}],
+    }
+
+
+def make_log(flaky):
+    log = b"INFO ordinary line\n" * 2000
+    if flaky:
+        log += b"get_num_new_matched_tokens 96\n" + b"INFO after\n" * 2000
+    return log
+
+
+class CheckerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.cache_dir = os.path.join(self.tmp.name, "cache")
+
+        stderr = mock.patch("sys.stderr", io.StringIO())
+        stderr.start()
+        self.addCleanup(stderr.stop)
+
+    def make_checker(self, session, *extra_args):
+        argv = ["flake-checker.py", "--token", "x", "--cache-dir", self.cache_dir, "--branch-regex", ""] + list(extra_args)
+        with mock.patch.object(sys, "argv", argv):
+            checker = flake_checker.FlakeChecker(flake_checker.parse_args())
+        checker.api_base = API
+        checker.session = session
+        return checker
+
+    def wait_until(self, condition, timeout=5.0):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            if time.monotonic() > deadline:
+                self.fail("condition not reached in time")
+            time.sleep(0.01)
+
+
+class InterruptTest(CheckerTestCase):
+    def test_interrupt_stops_running_downloads(self):
+        session = FakeSession([make_build(1)], {"job-1": make_log(False)}, chunk_delays={"job-1": 0.05})
+        checker = self.make_checker(session)
+        # Read the log in small pieces, so it takes seconds to download
+        chunk_size = mock.patch.object(flake_checker, "LOG_CHUNK_SIZE", 256)
+        chunk_size.start()
+        self.addCleanup(chunk_size.stop)
+
+        def interrupt(pending):
+            self.wait_until(lambda: session.responses.get("job-1") and session.responses["job-1"].chunks_sent > 2)
+            raise KeyboardInterrupt
+
+        checker._collect_results = interrupt
+        with self.assertRaises(SystemExit) as exit_info:
+            checker.scan_builds()
+        self.assertEqual(exit_info.exception.code, 130)
+
+        # The worker drops the stream at its next chunk instead of downloading the rest
+        response = session.responses["job-1"]
+        self.wait_until(lambda: response.closed, timeout=1.0)
+        self.assertLess(response.chunks_sent, len(response.content) // 256 // 2)
+
+
+
+class CheckpointTest(CheckerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.builds = [make_build(number) for number in range(5, 0, -1)]
+        self.logs = {f"job-{number}": make_log(flaky=number % 2 == 1) for number in range(1, 6)}
+
+    def run_scan(self, *extra_args, session=None):
+        session = session or FakeSession(self.builds, self.logs)
+        checker = self.make_checker(session, *extra_args)
+        checker.scan_job = mock.Mock(wraps=checker.scan_job)
+        checker.scan_builds()
+        return checker, session
+
+    def test_rerun_replays_stored_results(self):
+        full, _ = self.run_scan()
+        rerun, session = self.run_scan()
+
+        self.assertEqual(full.scan_job.call_count, 5)
+        self.assertEqual(rerun.scan_job.call_count, 0)
+        self.assertEqual(session.log_requests, [])
+        self.assertEqual(rerun.matches, full.matches)
+        self.assertEqual(rerun.jobs_scanned, full.jobs_scanned)
+
+    def test_checkpoint_is_ignored_for_other_patterns_or_rescan(self):
+        self.run_scan()
+
+        rescan, _ = self.run_scan("--rescan")
+        self.assertEqual(rescan.scan_job.call_count, 5)
+
+        patterns_file = os.path.join(self.tmp.name, "patterns.txt")
+        with open(patterns_file, "w") as f:
+            f.write("INFO after\n")
+        other, _ = self.run_scan("--patterns-file", patterns_file)
+        self.assertEqual(other.scan_job.call_count, 5)
+        self.assertEqual({match["build_number"] for match in other.matches}, {1, 3, 5})
+
+    def test_checkpoint_key_does_not_depend_on_json_library(self):
+        checker = self.make_checker(FakeSession([], {}))
+        key = checker._checkpoint_key()
+
+        with mock.patch.object(flake_checker, "orjson", None):
+            self.assertEqual(checker._checkpoint_key(), key)
+
+    def test_interrupt_keeps_finished_scans_that_were_not_collected(self):
+        chunk_size = mock.patch.object(flake_checker, "LOG_CHUNK_SIZE", 256)
+        chunk_size.start()
+        self.addCleanup(chunk_size.stop)
+
+        # The first job is slow, so results are collected in order only up to it
+        session = FakeSession(self.builds, self.logs, chunk_delays={"job-5": 0.05})
+        checker = self.make_checker(session)
+
+        def interrupt(pending):
+            self.wait_until(lambda: all(future.done() for _, _, _, future in pending[1:]))
+            raise KeyboardInterrupt
+
+        checker._collect_results = interrupt
+        with self.assertRaises(SystemExit):
+            checker.scan_builds()
+
+        with open(checker._checkpoint_path(), "rb") as f:
+            state = flake_checker._json_loads(f.read())
+        self.assertEqual(sorted(state["builds"]), ["1", "2", "3", "4"])
+
+        # Resuming only scans the job that hadn't finished, and reports everything
+        resumed, session = self.run_scan()
+        expected, _ = self.run_scan("--rescan")
+
+        self.assertEqual(session.log_requests, ["job-5"])
+        self.assertEqual(resumed.matches, expected.matches)
+        self.assertEqual({match["build_number"] for match in resumed.matches}, {1, 3, 5})
+
+
+
+class CachePruningTest(CheckerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.builds = [make_build(number) for number in range(5, 0, -1)]
+        self.logs = {f"job-{number}": make_log(flaky=False) for number in range(1, 6)}
+
+    def scan(self, *extra_args):
+        checker = self.make_checker(FakeSession(self.builds, self.logs), *extra_args)
+        checker.scan_builds()
+        return checker
+
+    def cached_builds(self, checker):
+        return sorted(os.listdir(os.path.join(self.cache_dir, "logs", "vllm", "ci")))
+
+    def age_log(self, checker, number, days):
+        path = checker._log_cache_path(number, f"job-{number}")
+        past = time.time() - days * 86400
+        os.utime(path, (past, past))
+
+    def test_short_scan_keeps_logs_outside_its_range(self):
+        self.scan()
+        checker = self.scan("--max-builds", "2")
+
+        self.assertEqual(self.cached_builds(checker), ["1", "2", "3", "4", "5"])
+        self.assertEqual(sorted(checker.checkpoint), ["1", "2", "3", "4", "5"])
+
+    def test_logs_older_than_max_age_expire_with_their_results(self):
+        checker = self.scan()
+        self.age_log(checker, 1, days=40)
+        self.age_log(checker, 2, days=10)
+
+        checker = self.scan("--cache-max-age", "30", "--max-builds", "2")
+
+        self.assertEqual(self.cached_builds(checker), ["2", "3", "4", "5"])
+        self.assertEqual(sorted(checker.checkpoint), ["2", "3", "4", "5"])
+
+    def test_zero_max_age_keeps_everything(self):
+        checker = self.scan()
+        self.age_log(checker, 1, days=400)
+
+        checker = self.scan("--cache-max-age", "0")
+
+        self.assertEqual(self.cached_builds(checker), ["1", "2", "3", "4", "5"])
+
+
+
+class LogCacheTest(CheckerTestCase):
+    def setUp(self):
+        super().setUp()
+        chunk_size = mock.patch.object(flake_checker, "LOG_CHUNK_SIZE", 1024)
+        chunk_size.start()
+        self.addCleanup(chunk_size.stop)
+
+        # The only pattern matches near the start, so the scan can stop early
+        self.patterns_file = os.path.join(self.tmp.name, "patterns.txt")
+        with open(self.patterns_file, "w") as f:
+            f.write("get_num_new_matched_tokens 96\n")
+        self.log = b"get_num_new_matched_tokens 96\n" + b"INFO ordinary line\n" * 2000
+        self.session = FakeSession([make_build(1)], {"job-1": self.log})
+
+    def make_checker(self, session, *extra_args):
+        return super().make_checker(session, "--patterns-file", self.patterns_file, *extra_args)
+
+    def test_log_that_matched_early_is_still_cached_in_full(self):
+        checker = self.make_checker(self.session)
+        checker.scan_builds()
+
+        with gzip.open(checker._log_cache_path(1, "job-1"), "rb") as f:
+            self.assertEqual(f.read(), self.log)
+        self.assertEqual(len(checker.matches), 1)
+
+        rerun = self.make_checker(FakeSession([make_build(1)], {"job-1": self.log}), "--rescan")
+        rerun.scan_builds()
+        self.assertEqual(rerun.session.log_requests, [])
+        self.assertEqual(rerun.matches, checker.matches)
+
+    def test_without_cache_download_stops_at_last_match(self):
+        checker = self.make_checker(self.session, "--no-cache")
+        checker.scan_builds()
+
+        self.assertEqual(len(checker.matches), 1)
+        self.assertLess(self.session.responses["job-1"].chunks_sent, len(self.log) // 1024)
+
+    def test_unreadable_cached_log_is_fetched_again(self):
+        checker = self.make_checker(self.session)
+        path = checker._log_cache_path(1, "job-1")
+        os.makedirs(os.path.dirname(path))
+        with open(path, "wb") as f:
+            f.write(b"not gzip")
+
+        checker.scan_builds()
+
+        self.assertEqual(self.session.log_requests, ["job-1"])
+        self.assertEqual(len(checker.matches), 1)
+        with gzip.open(path, "rb") as f:
+            self.assertEqual(f.read(), self.log)
+
+    def test_unwritable_cache_does_not_lose_matches(self):
+        blocker = os.path.join(self.tmp.name, "file")
+        open(blocker, "w").close()
+        self.cache_dir = os.path.join(blocker, "cache")
+
+        checker = self.make_checker(self.session)
+        checker.scan_builds()
+
+        self.assertEqual(len(checker.matches), 1)
+        self.assertEqual(sys.stderr.getvalue().count("Cache write failed"), 1)
+
+
+
+class ResponseCacheTest(CheckerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.session = FakeSession([make_build(1)], {"job-1": make_log(flaky=True)})
+
+    def test_unchanged_page_is_revalidated(self):
+        self.make_checker(self.session).scan_builds()
+        checker = self.make_checker(self.session)
+        checker.scan_builds()
+
+        self.assertEqual(len(self.session.page_requests), 2)
+        self.assertEqual(checker.builds_scanned, 1)
+        self.assertEqual(len(checker.matches), 1)
+
+    def test_malformed_cache_entries_are_misses(self):
+        checker = self.make_checker(self.session)
+        url_page = f"{API}/organizations/vllm/pipelines/ci/builds?page=1&per_page=50&include_retried_jobs=true"
+        path = checker._response_cache_path(url_page)
+        os.makedirs(os.path.dirname(path))
+
+        entries = [b"[1]", b'{"etag": "\\"v1\\""}', b'{"etag": "\\"v1\\"", "builds": {}, "next_url": null}',
+                   b'{"etag": 1, "builds": [], "next_url": null}', b"not json"]
+        for entry in entries:
+            with self.subTest(entry=entry):
+                with open(path, "wb") as f:
+                    f.write(entry)
+
+                checker = self.make_checker(self.session)
+                checker.scan_builds()
+
+                self.assertEqual(checker.builds_scanned, 1)
+                self.assertEqual(len(checker.matches), 1)
+
+    def test_unwritable_cache_does_not_abort_the_scan(self):
+        blocker = os.path.join(self.tmp.name, "file")
+        open(blocker, "w").close()
+        self.cache_dir = os.path.join(blocker, "cache")
+
+        checker = self.make_checker(self.session)
+        checker.scan_builds()
+
+        self.assertEqual(checker.builds_scanned, 1)
+
+
+
+class RateLimiterTest(unittest.TestCase):
+    def test_requests_go_out_while_budget_remains(self):
+        limiter = flake_checker.RateLimiter()
+        limiter.update({"RateLimit-Remaining": "2", "RateLimit-Reset": "60"})
+
+        start = time.monotonic()
+        limiter.acquire()
+        limiter.acquire()
+        self.assertLess(time.monotonic() - start, 0.1)
+        self.assertEqual(limiter.remaining, 0)
+
+    def test_exhausted_budget_waits_for_reset(self):
+        limiter = flake_checker.RateLimiter()
+        limiter.update({"RateLimit-Remaining": "0", "RateLimit-Reset": "0.2"})
+
+        start = time.monotonic()
+        limiter.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, 0.15)
+
+    def test_missing_headers_are_ignored(self):
+        limiter = flake_checker.RateLimiter()
+        limiter.update({"RateLimit-Remaining": "soon"})
+
+        self.assertIsNone(limiter.remaining)
+
+    def test_stop_event_ends_the_wait(self):
+        stop = threading.Event()
+        limiter = flake_checker.RateLimiter(stop)
+        limiter.update({"RateLimit-Remaining": "0", "RateLimit-Reset": "60"})
+        threading.Timer(0.1, stop.set).start()
+
+        start = time.monotonic()
+        with self.assertRaises(flake_checker.ScanInterrupted):
+            limiter.acquire()
+        self.assertLess(time.monotonic() - start, 2)
+
+
+class RetryTest(CheckerTestCase):
+    def test_rate_limited_request_is_retried(self):
+        session = FakeSession([make_build(1)], {"job-1": make_log(flaky=True)})
+        responses = [FakeResponse(429, headers={"RateLimit-Remaining": "0", "RateLimit-Reset": "0"})]
+        real_get = session.get
+        session.get = lambda url, **kwargs: responses.pop() if responses else real_get(url, **kwargs)
+
+        checker = self.make_checker(session, "--no-cache")
+        checker.interrupted.wait = mock.Mock()  # Skip the backoff delay
+        checker.scan_builds()
+
+        checker.interrupted.wait.assert_called_once()
+        self.assertEqual(len(checker.matches), 1)
+
+
+
+class OutputTest(CheckerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.builds = [make_build(number) for number in range(4, 0, -1)]
+        self.logs = {f"job-{number}": make_log(flaky=number % 2 == 0) for number in range(1, 5)}
+        self.output_path = os.path.join(self.tmp.name, "matches.ndjson")
+
+        # Compare against the stdlib encoder, which escapes non-ASCII like json.dumps does
+        no_orjson = mock.patch.object(flake_checker, "orjson", None)
+        no_orjson.start()
+        self.addCleanup(no_orjson.stop)
+
+    def json_report(self, *extra_args):
+        checker = self.make_checker(FakeSession(self.builds, self.logs), "--no-cache", "--json", *extra_args)
+        checker.scan_builds()
+        with mock.patch("sys.stdout", io.StringIO()) as stdout:
+            checker.output_results()
+        return checker, stdout.getvalue()
+
+    def test_json_report_matches_a_single_indented_dump(self):
+        checker, report = self.json_report()
+
+        expected = {
+            "summary": {"builds_scanned": 4, "jobs_scanned": 4, "matches_found": 2},
+            "matches": checker.matches,
+        }
+        self.assertEqual(report, json.dumps(expected, indent=2) + "\n")
+
+    def test_empty_json_report(self):
+        self.logs = {job_id: make_log(flaky=False) for job_id in self.logs}
+        _, report = self.json_report()
+
+        expected = {"summary": {"builds_scanned": 4, "jobs_scanned": 4, "matches_found": 0}, "matches": []}
+        self.assertEqual(report, json.dumps(expected, indent=2) + "\n")
+
+    def test_streamed_matches_give_the_same_report(self):
+        in_memory, expected_report = self.json_report()
+        streamed, report = self.json_report("--output", self.output_path)
+
+        self.assertEqual(streamed.matches, [])
+        self.assertEqual(report, expected_report)
+        with open(self.output_path) as f:
+            self.assertEqual([json.loads(line) for line in f], in_memory.matches)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,150 @@
+"""Compare streamed log scanning against a plain whole-log regex search.
+
+Run with: python -m unittest discover tests
+"""
+
+import contextlib
+import importlib.util
+import os
+import random
+import re
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "flake-checker.py")
+
+spec = importlib.util.spec_from_file_location("flake_checker", SCRIPT)
+flake_checker = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(flake_checker)
+
+# Fragments that random logs are built from: pattern pieces, blank line runs and multibyte characters
+WORDS = ["foo", "bar", "baz", "get_num 96", "FAILED x::t", "\n", "\n\n", "\n \n\n", " ", "é", "€", "𝄞", "abc\n", "x" * 150]
+
+CASES = {
+    # Three or fewer literals: bytes.find without the RE2 union
+    "few_literals": (["foo bar", "get_num 96", "ar b"], False),
+    # More literals: RE2 union prefilter, containment skipping
+    "literals": (["foo bar", "baz", "get_num 96", "FAILED x::t", "ar b", "o b", "foobarbaz"], False),
+    # Enough literals for Aho-Corasick, with duplicates and overlaps
+    "many_literals": (["foo bar", "baz", "get_num 96", "FAILED x::t", "ar b", "baz", "o b", "é baz", "abc foo",
+                       "96 f", "x::tf", "barfoo", "bazbaz", "ab", "c é", "foobarbaz", "zzz", "get_num 96F"], False),
+    # Real regexes, including ones only Python's re supports, mixed with plain literals
+    "regex": ([r"^baz", r"foo\s+bar", r"get_num \d+$", r"(?<=x)::t", r"(a)b\1", "o b", "get_num 96"], True),
+}
+
+# (name, module attributes to disable) for each engine combination
+ENGINES = [
+    ("all", {}),
+    ("no_re2", {"re2": None}),
+    ("no_ahocorasick", {"ahocorasick": None}),
+    ("stdlib_only", {"re2": None, "ahocorasick": None}),
+]
+
+
+def reference(patterns, use_regex, data):
+    """First match and snippet of each pattern, found by searching the whole log at once."""
+    results = []
+    for pattern in patterns:
+        source = pattern.encode() if use_regex else re.escape(pattern.encode())
+        match = re.search(source, data, re.MULTILINE)
+        if not match:
+            continue
+
+        start = max(0, match.start() - flake_checker.SNIPPET_CONTEXT)
+        end = min(len(data), match.end() + flake_checker.SNIPPET_CONTEXT)
+        while start < match.start() and 0x80 <= data[start] < 0xC0:
+            start += 1
+        while end > match.end() and end < len(data) and 0x80 <= data[end] < 0xC0:
+            end -= 1
+
+        snippet = re.sub(r"\n\s*\n+", "\n", data[start:end].decode("utf-8", "replace")).strip()
+        lines = snippet.split("\n")
+        if len(lines) > flake_checker.SNIPPET_MAX_LINES:
+            snippet = "\n".join(lines[:flake_checker.SNIPPET_MAX_LINES]) + "\n..."
+        results.append((pattern, snippet))
+    return results
+
+
+def chunked(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def random_chunks(rng, data):
+    cuts = sorted(rng.sample(range(len(data) + 1), min(len(data) + 1, rng.randint(0, 40))))
+    return [data[i:j] for i, j in zip([0] + cuts, cuts + [len(data)]) if i < j]
+
+
+class ScanChunksTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def make_checker(self, patterns, use_regex):
+        patterns_file = os.path.join(self.tmp.name, "patterns.txt")
+        with open(patterns_file, "w") as f:
+            f.write("\n".join(patterns) + "\n")
+
+        argv = ["flake-checker.py", "--token", "x", "--no-cache", "--patterns-file", patterns_file]
+        if use_regex:
+            argv.append("--regex")
+        with mock.patch.object(sys, "argv", argv), mock.patch("sys.stderr"):
+            return flake_checker.FlakeChecker(flake_checker.parse_args())
+
+    def test_matches_whole_log_search(self):
+        for engine, disabled in ENGINES:
+            for case, (patterns, use_regex) in CASES.items():
+                with self.subTest(engine=engine, case=case), contextlib.ExitStack() as stack:
+                    for name, value in disabled.items():
+                        stack.enter_context(mock.patch.object(flake_checker, name, value))
+                    checker = self.make_checker(patterns, use_regex)
+                    # Duplicates are dropped when patterns are loaded
+                    expected_patterns = list(dict.fromkeys(patterns))
+                    rng = random.Random(case)
+
+                    for _ in range(30):
+                        data = "".join(rng.choice(WORDS) for _ in range(rng.randint(0, 3000))).encode()
+                        expected = reference(expected_patterns, use_regex, data)
+
+                        chunkings = [[data], chunked(data, rng.randint(64, 512)), chunked(data, 4096),
+                                     chunked(data, flake_checker.LOG_CHUNK_SIZE), random_chunks(rng, data)]
+                        for chunks in chunkings:
+                            self.assertEqual(checker.scan_chunks(chunks), expected)
+
+    def test_chunk_boundaries_near_match(self):
+        checker = self.make_checker(["get_num 96"], False)
+        # The extra "-" puts the end of the trailing context in the middle of an "é"
+        data = b"x" * 5000 + b"get_num 96-" + "é".encode() * 300
+        context_end = 5010 + flake_checker.SNIPPET_CONTEXT
+
+        # Splits inside the match, and around the end of its trailing context, some mid-character
+        for split in list(range(4995, 5015)) + list(range(context_end - 5, context_end + 5)):
+            with self.subTest(split=split):
+                self.assertEqual(checker.scan_chunks([data[:split], data[split:]]), reference(["get_num 96"], False, data))
+
+    def test_contained_literals_are_searched_first(self):
+        matcher = flake_checker.PatternMatcher(["foo bar baz", "bar", "foo bar"], False)
+
+        self.assertEqual(matcher.contained, {0: [1, 2], 2: [1]})
+        self.assertEqual(matcher.search_order, [1, 2, 0])
+        self.assertEqual(matcher.search_window([0, 1, 2], b"-- foo bar baz", 0), {0: (3, 14), 1: (7, 10), 2: (3, 10)})
+        self.assertEqual(matcher.search_window([0, 2], b"-- foo baz", 0), {})
+
+    def test_regex_literals(self):
+        matcher = flake_checker.PatternMatcher(["plain text", r"a.b", "x|y"], True)
+
+        self.assertEqual(set(matcher.literals), {0})
+
+    def test_non_ascii_regex_warns_without_re2(self):
+        with mock.patch.object(flake_checker, "re2", None), mock.patch("sys.stderr") as stderr:
+            flake_checker.PatternMatcher(["caf[éè]", "café", "a.b"], True)
+        warnings = "".join(call.args[0] for call in stderr.write.call_args_list)
+
+        self.assertIn("'caf[éè]'", warnings)
+        self.assertNotIn("'café'", warnings)
+        self.assertNotIn("'a.b'", warnings)
+
+
+if __name__ == "__main__":
+    unittest.main()